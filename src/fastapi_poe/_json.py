@@ -0,0 +1,112 @@
+"""
+
+JSON helpers for the hot paths of the client and the bot server. These use `orjson` when it is
+installed (`pip install fastapi_poe[orjson]`) and pydantic-core's parser and serializer, which
+come with pydantic, otherwise.
+
+NaN and infinite floats are encoded as `null` on every path, as orjson does, so the output is
+valid JSON whether or not orjson is installed.
+
+Decoding errors are always raised as `json.JSONDecodeError` (which `orjson.JSONDecodeError`
+subclasses), so callers can keep catching the standard library exception.
+
+"""
+
+import json
+import math
+from typing import Union
+
+from pydantic_core import to_json
+
+try:
+    from pydantic_core import from_json
+except ImportError:  # pydantic-core older than 2.10 (pydantic < 2.5)
+    from_json = json.loads
+
+
+def _replace_non_finite(obj: object) -> object:
+    # NaN and infinities are not valid JSON; encode them as null, as orjson does.
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _replace_non_finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_replace_non_finite(value) for value in obj]
+    return obj
+
+
+try:
+    to_json(float("nan"), inf_nan_mode="null")
+except TypeError:  # pydantic-core without inf_nan_mode, which would write NaN
+
+    def _to_json(obj: object) -> bytes:
+        return to_json(_replace_non_finite(obj))
+
+else:
+
+    def _to_json(obj: object) -> bytes:
+        return to_json(obj, inf_nan_mode="null")
+
+
+def _fallback_dumps(obj: object) -> bytes:
+    try:
+        # Compact UTF-8 output like orjson's, and several times faster than json.dumps().
+        return _to_json(obj)
+    except ValueError:
+        # Like orjson, pydantic-core rejects strings containing lone surrogates, which model
+        # output can contain. json.dumps() escapes them instead.
+        return json.dumps(_replace_non_finite(obj)).encode()
+
+
+def _fallback_loads(data: Union[str, bytes]) -> object:
+    try:
+        return from_json(data)
+    except ValueError:
+        # pydantic-core rejects escaped lone surrogates, which json.loads() accepts. This also
+        # raises json.JSONDecodeError for input that really is invalid.
+        return json.loads(data)
+
+
+try:
+    import orjson  # pyright: ignore[reportMissingImports]
+except ImportError:
+
+    def loads(data: Union[str, bytes]) -> object:
+        return _fallback_loads(data)
+
+    def dumps(obj: object) -> bytes:
+        return _fallback_dumps(obj)
+
+else:
+
+    def loads(data: Union[str, bytes]) -> object:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson rejects some input that json.loads() accepts, such as escaped lone
+            # surrogates (which dumps() can produce) and NaN or Infinity literals.
+            return json.loads(data)
+
+    def dumps(obj: object) -> bytes:
+        try:
+            return orjson.dumps(obj)
+        except orjson.JSONEncodeError:
+            # orjson rejects some values that the fallback accepts, such as integers wider
+            # than 64 bits and strings containing lone surrogates.
+            return _fallback_dumps(obj)
+
+
+# Line separators that JSON allows unescaped inside strings, but that some SSE clients split
+# lines on (e.g. anything built on str.splitlines()). json.dumps() escaped all non-ASCII
+# characters, so keep escaping these three.
+_SSE_UNSAFE_CHARS = str.maketrans(
+    {"\x85": "\\u0085", "\u2028": "\\u2028", "\u2029": "\\u2029"}
+)
+
+
+def dumps_sse_data(obj: object) -> str:
+    """Serialize `obj` for the data field of a server-sent event."""
+    data = dumps(obj).decode()
+    if data.isascii():
+        return data
+    return data.translate(_SSE_UNSAFE_CHARS)
@@ -3,13 +3,15 @@ import asyncio
 import copy
 import json
 import logging
+import mimetypes
 import os
+import re
 import sys
 import warnings
 from collections import defaultdict
 from collections.abc import AsyncIterable, Awaitable, Sequence
 from dataclasses import dataclass
-from typing import BinaryIO, Callable, Optional, Union
+from typing import Any, BinaryIO, Callable, Optional, Union, cast
 
 import httpx
 import httpx_sse
@@ -23,7 +25,8 @@ from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.types import Message
 from typing_extensions import deprecated, overload
 
-from fastapi_poe.client import PROTOCOL_VERSION, sync_bot_settings
+from fastapi_poe import _json
+from fastapi_poe.client import PROTOCOL_VERSION, _get_shared_session, sync_bot_settings
 from fastapi_poe.templates import (
     IMAGE_VISION_ATTACHMENT_TEMPLATE,
     TEXT_ATTACHMENT_TEMPLATE,
@@ -318,7 +321,7 @@ class PoeBot:
         *,
         download_url: Optional[str] = None,
         download_filename: Optional[str] = None,
-        file_data: Optional[Union[bytes, BinaryIO]] = None,
+        file_data: Optional[Union[bytes, bytearray, memoryview, BinaryIO]] = None,
         filename: Optional[str] = None,
         content_type: Optional[str] = None,
         is_inline: bool = False,
@@ -332,7 +335,7 @@ class PoeBot:
         message_id: Identifier,
         download_url: Optional[str] = None,
         download_filename: Optional[str] = None,
-        file_data: Optional[Union[bytes, BinaryIO]] = None,
+        file_data: Optional[Union[bytes, bytearray, memoryview, BinaryIO]] = None,
         filename: Optional[str] = None,
         content_type: Optional[str] = None,
         is_inline: bool = False,
@@ -345,7 +348,7 @@ class PoeBot:
         *,
         download_url: Optional[str] = None,
         download_filename: Optional[str] = None,
-        file_data: Optional[Union[bytes, BinaryIO]] = None,
+        file_data: Optional[Union[bytes, bytearray, memoryview, BinaryIO]] = None,
         filename: Optional[str] = None,
         content_type: Optional[str] = None,
         is_inline: bool = False,
@@ -363,8 +366,9 @@ class PoeBot:
         - `download_url` (`Optional[str] = None`): A url to the file to be attached to the message.
         - `download_filename` (`Optional[str] = None`): A filename to be used when storing the
         downloaded attachment. If not set, the filename from the `download_url` is used.
-        - `file_data` (`Optional[Union[bytes, BinaryIO]] = None`): The contents of the file to be
-        uploaded. This should be a bytes-like or file object.
+        - `file_data` (`Optional[Union[bytes, bytearray, memoryview, BinaryIO]] = None`): The
+        contents of the file to be uploaded. This should be a bytes-like or file object. Large files
+        are best passed as an open file, which is streamed instead of being copied into memory.
         - `filename` (`Optional[str] = None`): The name of the file to be attached.
         #### Returns:
         - `AttachmentUploadResponse`
@@ -376,6 +380,74 @@ class PoeBot:
         if message_id is None:
             raise InvalidParameterError("message_id parameter is required")
 
+        task = self._schedule_file_attachment_request(
+            access_key=access_key,
+            message_id=message_id,
+            download_url=download_url,
+            download_filename=download_filename,
+            file_data=file_data,
+            filename=filename,
+            content_type=content_type,
+            is_inline=is_inline,
+        )
+        try:
+            return await task
+        finally:
+            # The caller already gets this upload's result or error, so the end of the
+            # response does not need to wait for it again.
+            pending_tasks_for_message = self._pending_file_attachment_tasks.get(
+                message_id
+            )
+            if pending_tasks_for_message is not None:
+                pending_tasks_for_message.discard(task)
+
+    def schedule_message_attachment(
+        self,
+        *,
+        message_id: Identifier,
+        download_url: Optional[str] = None,
+        download_filename: Optional[str] = None,
+        file_data: Optional[Union[bytes, bytearray, memoryview, BinaryIO]] = None,
+        filename: Optional[str] = None,
+        content_type: Optional[str] = None,
+        is_inline: bool = False,
+    ) -> "asyncio.Task[AttachmentUploadResponse]":
+        """
+
+        Start uploading an attachment for your bot's response without waiting for it. This lets
+        your bot keep streaming text while the file uploads. The upload is always finished
+        before the response is completed, and if it fails the response ends with an error. Await
+        the returned task if you need its result (for example the `inline_ref` of an inline
+        attachment) earlier.
+
+        #### Parameters:
+        Same as `post_message_attachment`, except that the bot's own access_key is always used.
+        #### Returns:
+        - `asyncio.Task[AttachmentUploadResponse]`
+
+        """
+        return self._schedule_file_attachment_request(
+            message_id=message_id,
+            download_url=download_url,
+            download_filename=download_filename,
+            file_data=file_data,
+            filename=filename,
+            content_type=content_type,
+            is_inline=is_inline,
+        )
+
+    def _schedule_file_attachment_request(
+        self,
+        message_id: Identifier,
+        *,
+        access_key: Optional[str] = None,
+        download_url: Optional[str] = None,
+        download_filename: Optional[str] = None,
+        file_data: Optional[Union[bytes, bytearray, memoryview, BinaryIO]] = None,
+        filename: Optional[str] = None,
+        content_type: Optional[str] = None,
+        is_inline: bool = False,
+    ) -> "asyncio.Task[AttachmentUploadResponse]":
         task = asyncio.create_task(
             self._make_file_attachment_request(
                 access_key=access_key,
@@ -392,11 +464,10 @@ class PoeBot:
         if pending_tasks_for_message is None:
             pending_tasks_for_message = set()
             self._pending_file_attachment_tasks[message_id] = pending_tasks_for_message
+        # Tasks stay in the set until _process_pending_attachment_requests() gathers them,
+        # even once finished, so that a failed background upload is still reported.
         pending_tasks_for_message.add(task)
-        try:
-            return await task
-        finally:
-            pending_tasks_for_message.remove(task)
+        return task
 
     async def _make_file_attachment_request(
         self,
@@ -405,7 +476,7 @@ class PoeBot:
         access_key: Optional[str] = None,
         download_url: Optional[str] = None,
         download_filename: Optional[str] = None,
-        file_data: Optional[Union[bytes, BinaryIO]] = None,
+        file_data: Optional[Union[bytes, bytearray, memoryview, BinaryIO]] = None,
         filename: Optional[str] = None,
         content_type: Optional[str] = None,
         is_inline: bool = False,
@@ -429,55 +500,83 @@ class PoeBot:
             attachment_access_key = access_key
         url = "https://www.quora.com/poe_api/file_attachment_3RD_PARTY_POST"
 
-        async with httpx.AsyncClient(timeout=120) as client:
-            try:
-                headers = {"Authorization": f"{attachment_access_key}"}
-                if download_url:
-                    if file_data or filename:
-                        raise InvalidParameterError(
-                            "Cannot provide filename or file_data if download_url is provided."
-                        )
-                    data = {
-                        "message_id": message_id,
-                        "is_inline": is_inline,
-                        "download_url": download_url,
-                    }
-                    if download_filename:
-                        data["download_filename"] = download_filename
-                    request = httpx.Request("POST", url, data=data, headers=headers)
-                elif file_data and filename:
-                    data = {"message_id": message_id, "is_inline": is_inline}
-                    files = {
-                        "file": (
-                            (filename, file_data)
-                            if content_type is None
-                            else (filename, file_data, content_type)
-                        )
-                    }
-                    request = httpx.Request(
-                        "POST", url, files=files, data=data, headers=headers
-                    )
-                else:
+        # Uploads share the client's connection pool, so consecutive attachments skip the
+        # TCP and TLS handshakes.
+        client = _get_shared_session()
+        try:
+            headers = {"Authorization": f"{attachment_access_key}"}
+            if download_url:
+                if file_data or filename:
                     raise InvalidParameterError(
-                        "Must provide either download_url or file_data and filename."
+                        "Cannot provide filename or file_data if download_url is provided."
                     )
-                response = await client.send(request)
-
-                if response.status_code != 200:
-                    error_pieces = [piece async for piece in response.aiter_text()]
-                    raise AttachmentUploadError(
-                        f"{response.status_code} {response.reason_phrase}: {''.join(error_pieces)}"
+                data = {
+                    "message_id": message_id,
+                    "is_inline": is_inline,
+                    "download_url": download_url,
+                }
+                if download_filename:
+                    data["download_filename"] = download_filename
+                request = client.build_request(
+                    "POST", url, data=data, headers=headers, timeout=120
+                )
+            elif (
+                file_data
+                and filename
+                and isinstance(file_data, (bytes, bytearray, memoryview))
+            ):
+                body, multipart_content_type = _encode_multipart_file(
+                    fields={
+                        "message_id": message_id,
+                        "is_inline": "true" if is_inline else "false",
+                    },
+                    filename=filename,
+                    file_data=file_data,
+                    content_type=content_type,
+                )
+                request = client.build_request(
+                    "POST",
+                    url,
+                    content=body,
+                    headers={**headers, "Content-Type": multipart_content_type},
+                    timeout=120,
+                )
+            elif file_data and filename:
+                # Bytes-like data took the branch above, so this is a file object.
+                file_obj = cast(BinaryIO, file_data)
+                data = {"message_id": message_id, "is_inline": is_inline}
+                files = {
+                    "file": (
+                        (filename, file_obj)
+                        if content_type is None
+                        else (filename, file_obj, content_type)
                     )
+                }
+                request = client.build_request(
+                    "POST", url, files=files, data=data, headers=headers, timeout=120
+                )
+            else:
+                raise InvalidParameterError(
+                    "Must provide either download_url or file_data and filename."
+                )
+            # send() reads the whole body once; both branches below use that buffer.
+            response = await client.send(request)
 
-                response_data = response.json()
-                return AttachmentUploadResponse(
-                    inline_ref=response_data.get("inline_ref"),
-                    attachment_url=response_data.get("attachment_url"),
+            if response.status_code != 200:
+                raise AttachmentUploadError(
+                    f"{response.status_code} {response.reason_phrase}: {response.text}"
                 )
 
-            except httpx.HTTPError:
-                logger.error("An HTTP error occurred when attempting to attach file")
-                raise
+            response_data = cast(dict[str, Any], _json.loads(response.content))
+            # The response comes from Poe's own upload endpoint, so skip validation.
+            return AttachmentUploadResponse.model_construct(
+                inline_ref=response_data.get("inline_ref"),
+                attachment_url=response_data.get("attachment_url"),
+            )
+
+        except httpx.HTTPError:
+            logger.error("An HTTP error occurred when attempting to attach file")
+            raise
 
     async def _process_pending_attachment_requests(
         self, message_id: Identifier
@@ -719,12 +818,9 @@ class PoeBot:
         amounts_dicts = [amount.model_dump() for amount in amounts]
         data = {"amounts": amounts_dicts, "access_key": access_key}
         try:
-            async with (
-                httpx.AsyncClient(timeout=300) as client,
-                httpx_sse.aconnect_sse(
-                    client, method="POST", url=url, json=data
-                ) as event_source,
-            ):
+            async with httpx_sse.aconnect_sse(
+                _get_shared_session(), method="POST", url=url, json=data, timeout=300
+            ) as event_source:
                 if event_source.response.status_code != 200:
                     error_pieces = [
                         json.loads(event.data).get("message", "")
@@ -749,12 +845,12 @@ class PoeBot:
 
     @staticmethod
     def text_event(text: str) -> ServerSentEvent:
-        return ServerSentEvent(data=json.dumps({"text": text}), event="text")
+        return ServerSentEvent(data=_json.dumps_sse_data({"text": text}), event="text")
 
     @staticmethod
     def replace_response_event(text: str) -> ServerSentEvent:
         return ServerSentEvent(
-            data=json.dumps({"text": text}), event="replace_response"
+            data=_json.dumps_sse_data({"text": text}), event="replace_response"
         )
 
     @staticmethod
@@ -763,7 +859,9 @@ class PoeBot:
 
     @staticmethod
     def suggested_reply_event(text: str) -> ServerSentEvent:
-        return ServerSentEvent(data=json.dumps({"text": text}), event="suggested_reply")
+        return ServerSentEvent(
+            data=_json.dumps_sse_data({"text": text}), event="suggested_reply"
+        )
 
     @staticmethod
     def meta_event(
@@ -774,7 +872,7 @@ class PoeBot:
         suggested_replies: bool = False,
     ) -> ServerSentEvent:
         return ServerSentEvent(
-            data=json.dumps(
+            data=_json.dumps_sse_data(
                 {
                     "content_type": content_type,
                     "refetch_settings": refetch_settings,
@@ -800,7 +898,7 @@ class PoeBot:
             data["raw_response"] = repr(raw_response)
         if error_type is not None:
             data["error_type"] = error_type
-        return ServerSentEvent(data=json.dumps(data), event="error")
+        return ServerSentEvent(data=_json.dumps_sse_data(data), event="error")
 
     # Internal handlers
 
@@ -886,6 +984,49 @@ class PoeBot:
         yield self.done_event()
 
 
+_MULTIPART_PARAM_ESCAPES = {'"': "%22", "\\": "\\\\"}
+_MULTIPART_PARAM_ESCAPES.update({chr(c): f"%{c:02X}" for c in range(0x20) if c != 0x1B})
+_MULTIPART_PARAM_ESCAPE_RE = re.compile(
+    "|".join(re.escape(c) for c in _MULTIPART_PARAM_ESCAPES)
+)
+
+
+def _encode_multipart_file(
+    *,
+    fields: dict[str, str],
+    filename: str,
+    file_data: Union[bytes, bytearray, memoryview],
+    content_type: Optional[str],
+) -> tuple[bytes, str]:
+    """Encodes a multipart/form-data body with a single file into one exact-size buffer.
+
+    The output matches what httpx produces for `data=fields, files={"file": ...}`, but avoids
+    its per-field streaming machinery when the file contents are already in memory. Returns the
+    body and the value for the Content-Type header.
+
+    """
+    boundary = os.urandom(16).hex().encode()
+    if content_type is None:
+        content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    escaped_filename = _MULTIPART_PARAM_ESCAPE_RE.sub(
+        lambda match: _MULTIPART_PARAM_ESCAPES[match.group(0)], filename
+    )
+    parts: list[Union[bytes, bytearray, memoryview]] = []
+    for name, value in fields.items():
+        parts.append(
+            b'--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n'
+            % (boundary, name.encode(), value.encode())
+        )
+    parts.append(
+        b'--%s\r\nContent-Disposition: form-data; name="file"; filename="%s"\r\n'
+        b"Content-Type: %s\r\n\r\n"
+        % (boundary, escaped_filename.encode(), content_type.encode())
+    )
+    parts.append(file_data)
+    parts.append(b"\r\n--%s--\r\n" % boundary)
+    return b"".join(parts), f"multipart/form-data; boundary={boundary.decode()}"
+
+
 def _find_access_key(*, access_key: str, api_key: str) -> Optional[str]:
     """Figures out the access key.
 
@@ -971,10 +1112,11 @@ def _add_routes_for_bot(app: FastAPI, bot: PoeBot) -> None:
     async def poe_post(request: Request, dict: object = Depends(auth_user)) -> Response:
         request_body = await request.json()
         request_body["http_request"] = request
-        if request_body["type"] == "query":
+        request_type = request_body["type"]
+        if request_type == "query":
             return EventSourceResponse(
                 bot.handle_query(
-                    QueryRequest.parse_obj(
+                    QueryRequest.model_validate(
                         {
                             **request_body,
                             "access_key": bot.access_key or "<missing>",
@@ -984,24 +1126,24 @@ def _add_routes_for_bot(app: FastAPI, bot: PoeBot) -> None:
                     RequestContext(http_request=request),
                 )
             )
-        elif request_body["type"] == "settings":
+        elif request_type == "settings":
             return await bot.handle_settings(
-                SettingsRequest.parse_obj(request_body),
+                SettingsRequest.model_validate(request_body),
                 RequestContext(http_request=request),
             )
-        elif request_body["type"] == "report_feedback":
+        elif request_type == "report_feedback":
             return await bot.handle_report_feedback(
-                ReportFeedbackRequest.parse_obj(request_body),
+                ReportFeedbackRequest.model_validate(request_body),
                 RequestContext(http_request=request),
             )
-        elif request_body["type"] == "report_reaction":
+        elif request_type == "report_reaction":
             return await bot.handle_report_reaction(
-                ReportReactionRequest.parse_obj(request_body),
+                ReportReactionRequest.model_validate(request_body),
                 RequestContext(http_request=request),
             )
-        elif request_body["type"] == "report_error":
+        elif request_type == "report_error":
             return await bot.handle_report_error(
-                ReportErrorRequest.parse_obj(request_body),
+                ReportErrorRequest.model_validate(request_body),
                 RequestContext(http_request=request),
             )
         else:
@@ -1011,6 +1153,22 @@ def _add_routes_for_bot(app: FastAPI, bot: PoeBot) -> None:
     app.post(bot.path)(poe_post)
 
 
+async def _fetch_bot_settings(
+    bots: Sequence[PoeBot],
+) -> list[Union[SettingsResponse, Exception]]:
+    results: list[Union[SettingsResponse, Exception]] = []
+    for bot in bots:
+        try:
+            settings = await bot.get_settings(
+                SettingsRequest(version=PROTOCOL_VERSION, type="settings")
+            )
+        except Exception as e:
+            results.append(e)
+        else:
+            results.append(settings)
+    return results
+
+
 def make_app(
     bot: Union[PoeBot, Sequence[PoeBot]],
     access_key: str = "",
@@ -1086,6 +1244,7 @@ def make_app(
                 "Please use a different path for each bot."
             )
 
+    bots_to_sync = []
     for bot_obj in bots:
         if bot_obj.access_key is None and not allow_without_key:
             raise ValueError(f"Missing access key on {bot_obj}")
@@ -1100,15 +1259,23 @@ def make_app(
             )
             logger.warning("\n************* Warning *************")
         else:
+            bots_to_sync.append(bot_obj)
+
+    if bots_to_sync:
+        # A single asyncio.run() (backed by asyncio.Runner on Python 3.11+) fetches the settings
+        # of every bot, instead of creating and tearing down an event loop per bot.
+        try:
+            settings_results = asyncio.run(_fetch_bot_settings(bots_to_sync))
+        except Exception as e:
+            settings_results = [e] * len(bots_to_sync)
+        for bot_obj, settings_result in zip(bots_to_sync, settings_results):
+            assert bot_obj.bot_name is not None and bot_obj.access_key is not None
             try:
-                settings_response = asyncio.run(
-                    bot_obj.get_settings(
-                        SettingsRequest(version=PROTOCOL_VERSION, type="settings")
-                    )
-                )
+                if isinstance(settings_result, Exception):
+                    raise settings_result
                 sync_bot_settings(
                     bot_name=bot_obj.bot_name,
-                    settings=settings_response.model_dump(),
+                    settings=settings_result.model_dump(),
                     access_key=bot_obj.access_key,
                 )
             except Exception as e:
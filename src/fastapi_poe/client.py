@@ -6,17 +6,22 @@ For more details, see: https://creator.poe.com/docs/server-bots-functional-guide
 """
 
 import asyncio
-import contextlib
+import atexit
+import http.cookiejar
 import inspect
 import json
+import sys
 import warnings
-from collections.abc import AsyncGenerator
+import weakref
+from collections.abc import AsyncGenerator, Awaitable
 from dataclasses import dataclass, field
-from typing import Any, Callable, Optional, cast
+from typing import Any, Callable, ClassVar, Optional, cast
 
 import httpx
 import httpx_sse
+from pydantic import BaseModel, ConfigDict, ValidationError
 
+from . import _json
 from .types import (
     ContentType,
     Identifier,
@@ -54,24 +59,91 @@ class InvalidBotSettings(Exception):
 def _safe_ellipsis(obj: object, limit: int) -> str:
     if not isinstance(obj, str):
         obj = repr(obj)
-    if len(obj) > limit:
-        obj = obj[: limit - 3] + "..."
-    return obj
+    return _safe_ellipsis_str(obj, limit)
 
 
-@dataclass
+def _safe_ellipsis_str(text: str, limit: int) -> str:
+    if len(text) > limit:
+        return text[: limit - 3] + "..."
+    return text
+
+
+def _parse_text_field(data: str) -> Optional[str]:
+    """Synchronous fast path for well-formed "text" events.
+
+    Returns None if the event is not a JSON object with a string "text" field; the caller
+    then falls back to _BotContext._get_single_json_field for error reporting.
+
+    """
+    try:
+        parsed = _json.loads(data)
+    except json.JSONDecodeError:
+        return None
+    if parsed.__class__ is not dict:
+        return None
+    text = cast(dict[str, object], parsed).get("text")
+    return text if isinstance(text, str) else None
+
+
+# The per-request dataclasses below have their attributes read on every event, so give them
+# slots where dataclasses support them (Python 3.10+).
+_SLOTS: dict[str, bool] = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**_SLOTS)
+class _QueryState:
+    """Per-request state shared by the event handlers in perform_query_request."""
+
+    message_id: Identifier
+    full_prompt: str
+    with_raw_response: bool
+    is_first_event: bool = True
+    got_text: bool = False
+    error_reported: bool = False
+
+
+class _MetaEventData(BaseModel):
+    """The fields of a 'meta' event. Strict, so that e.g. 1 is not accepted as a bool."""
+
+    model_config = ConfigDict(strict=True)
+
+    linkify: bool = False
+    suggested_replies: bool = False
+    content_type: str = "text/markdown"
+
+
+_EventHandler = Callable[
+    ["_BotContext", httpx_sse.ServerSentEvent, _QueryState],
+    Awaitable[Optional[BotMessage]],
+]
+
+
+@dataclass(**_SLOTS)
 class _BotContext:
     endpoint: str
     session: httpx.AsyncClient = field(repr=False)
     api_key: Optional[str] = field(default=None, repr=False)
     on_error: Optional[ErrorHandler] = field(default=None, repr=False)
+    headers: dict[str, str] = field(init=False, repr=False)
+    _background_reports: set["asyncio.Task[None]"] = field(
+        init=False, repr=False, default_factory=set
+    )
 
-    @property
-    def headers(self) -> dict[str, str]:
-        headers = {"Accept": "application/json"}
+    def __post_init__(self) -> None:
+        self.headers = {"Accept": "application/json"}
         if self.api_key is not None:
-            headers["Authorization"] = f"Bearer {self.api_key}"
-        return headers
+            self.headers["Authorization"] = f"Bearer {self.api_key}"
+
+    def _json_headers(self) -> dict[str, str]:
+        # Always a fresh dict: httpx_sse.aconnect_sse() modifies the headers it is given.
+        return {**self.headers, "Content-Type": "application/json"}
+
+    async def _post_json(self, body: dict[str, Any]) -> httpx.Response:
+        # Serialize the body ourselves (with orjson if available) instead of going through
+        # httpx's json= encoding, which always uses the standard library.
+        return await self.session.post(
+            self.endpoint, headers=self._json_headers(), content=_json.dumps(body)
+        )
 
     async def report_error(
         self, message: str, metadata: Optional[dict[str, Any]] = None
@@ -83,17 +155,39 @@ class _BotContext:
                 f"for endpoint {self.endpoint}"
             )
             self.on_error(BotError(message), long_message)
-        await self.session.post(
-            self.endpoint,
-            headers=self.headers,
-            json={
+        await self._post_json(
+            {
                 "version": PROTOCOL_VERSION,
                 "type": "report_error",
                 "message": message,
                 "metadata": metadata or {},
-            },
+            }
         )
 
+    def _report_error_in_background(
+        self, message: str, metadata: Optional[dict[str, Any]] = None
+    ) -> None:
+        """Like report_error, but lets the caller keep streaming while the report is sent.
+
+        perform_query_request waits for these before it finishes.
+
+        """
+        task = asyncio.create_task(self.report_error(message, metadata))
+        self._background_reports.add(task)
+        task.add_done_callback(self._background_reports.discard)
+
+    async def _wait_for_background_reports(self) -> None:
+        if not self._background_reports:
+            return
+        results = await asyncio.gather(
+            *self._background_reports, return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception) and self.on_error is not None:
+                self.on_error(
+                    result, f"Failed to send error report to endpoint {self.endpoint}"
+                )
+
     async def report_feedback(
         self,
         message_id: Identifier,
@@ -102,17 +196,15 @@ class _BotContext:
         feedback_type: str,
     ) -> None:
         """Report message feedback to the bot server."""
-        await self.session.post(
-            self.endpoint,
-            headers=self.headers,
-            json={
+        await self._post_json(
+            {
                 "version": PROTOCOL_VERSION,
                 "type": "report_feedback",
                 "message_id": message_id,
                 "user_id": user_id,
                 "conversation_id": conversation_id,
                 "feedback_type": feedback_type,
-            },
+            }
         )
 
     async def report_reaction(
@@ -123,165 +215,222 @@ class _BotContext:
         reaction: str,
     ) -> None:
         """Report message reaction to the bot server."""
-        await self.session.post(
-            self.endpoint,
-            headers=self.headers,
-            json={
+        await self._post_json(
+            {
                 "version": PROTOCOL_VERSION,
                 "type": "report_reaction",
                 "message_id": message_id,
                 "user_id": user_id,
                 "conversation_id": conversation_id,
                 "reaction": reaction,
-            },
+            }
         )
 
     async def fetch_settings(self) -> SettingsResponse:
         """Fetches settings from a Poe server bot endpoint."""
-        resp = await self.session.post(
-            self.endpoint,
-            headers=self.headers,
-            json={"version": PROTOCOL_VERSION, "type": "settings"},
-        )
+        resp = await self._post_json({"version": PROTOCOL_VERSION, "type": "settings"})
         return resp.json()
 
     async def perform_query_request(
         self,
         *,
         request: QueryRequest,
+        content: bytes,
         tools: Optional[list[ToolDefinition]],
-        tool_calls: Optional[list[ToolCallDefinition]],
-        tool_results: Optional[list[ToolResultDefinition]],
+        with_raw_response: bool = True,
     ) -> AsyncGenerator[BotMessage, None]:
-        chunks: list[str] = []
-        message_id = request.message_id
-        event_count = 0
-        error_reported = False
-        payload = request.model_dump()
-        if tools is not None:
-            payload["tools"] = [tool.model_dump() for tool in tools]
-        if tool_calls is not None:
-            payload["tool_calls"] = [tool_call.model_dump() for tool_call in tool_calls]
-        if tool_results is not None:
-            payload["tool_results"] = [
-                tool_result.model_dump() for tool_result in tool_results
-            ]
+        # repr() walks the whole conversation, so compute it once rather than per event.
+        state = _QueryState(
+            message_id=request.message_id,
+            full_prompt=repr(request),
+            with_raw_response=with_raw_response,
+        )
         async with httpx_sse.aconnect_sse(
-            self.session, "POST", self.endpoint, headers=self.headers, json=payload
+            self.session,
+            "POST",
+            self.endpoint,
+            headers=self._json_headers(),
+            content=content,
         ) as event_source:
-            async for event in event_source.aiter_sse():
-                event_count += 1
-                if event.event == "done":
-                    # Don't send a report if we already told the bot about some other mistake.
-                    if not chunks and not error_reported and not tools:
-                        await self.report_error(
-                            "Bot returned no text in response",
-                            {"message_id": message_id},
-                        )
-                    return
-                elif event.event == "text":
-                    text = await self._get_single_json_field(
-                        event.data, "text", message_id
-                    )
-                elif event.event == "replace_response":
-                    text = await self._get_single_json_field(
-                        event.data, "replace_response", message_id
-                    )
-                    chunks.clear()
-                elif event.event == "suggested_reply":
-                    text = await self._get_single_json_field(
-                        event.data, "suggested_reply", message_id
-                    )
-                    yield BotMessage(
-                        text=text,
-                        raw_response={"type": event.event, "text": event.data},
-                        full_prompt=repr(request),
-                        is_suggested_reply=True,
-                    )
-                    continue
-                elif event.event == "json":
-                    yield BotMessage(
-                        text="", data=json.loads(event.data), full_prompt=repr(request)
-                    )
-                    continue
-                elif event.event == "meta":
-                    if event_count != 1:
-                        # spec says a meta event that is not the first event is ignored
-                        continue
-                    data = await self._load_json_dict(event.data, "meta", message_id)
-                    linkify = data.get("linkify", False)
-                    if not isinstance(linkify, bool):
-                        await self.report_error(
-                            "Invalid linkify value in 'meta' event",
-                            {"message_id": message_id, "linkify": linkify},
-                        )
-                        error_reported = True
-                        continue
-                    send_suggested_replies = data.get("suggested_replies", False)
-                    if not isinstance(send_suggested_replies, bool):
-                        await self.report_error(
-                            "Invalid suggested_replies value in 'meta' event",
-                            {
-                                "message_id": message_id,
-                                "suggested_replies": send_suggested_replies,
-                            },
-                        )
-                        error_reported = True
-                        continue
-                    content_type = data.get("content_type", "text/markdown")
-                    if not isinstance(content_type, str):
-                        await self.report_error(
-                            "Invalid content_type value in 'meta' event",
-                            {"message_id": message_id, "content_type": content_type},
+            # Bind what the per-event path needs to locals; this loop runs once per token.
+            get_single_json_field = self._get_single_json_field
+            event_handlers = self._event_handlers
+            message_id = state.message_id
+            full_prompt = state.full_prompt
+            try:
+                async for event in event_source.aiter_sse():
+                    event_name = event.event
+                    # "text" is by far the most common event, so handle it before anything else.
+                    if event_name == "text":
+                        data = event.data
+                        text = _parse_text_field(data)
+                        if text is None:
+                            # Malformed event: go through the slow path, which reports the
+                            # problem to the bot and raises.
+                            text = await get_single_json_field(data, "text", message_id)
+                        state.got_text = True
+                        yield BotMessage(
+                            text=text,
+                            raw_response=(
+                                {"type": event_name, "text": data}
+                                if with_raw_response
+                                else None
+                            ),
+                            full_prompt=full_prompt,
                         )
-                        error_reported = True
-                        continue
-                    yield MetaMessage(
-                        text="",
-                        raw_response=data,
-                        full_prompt=repr(request),
-                        linkify=linkify,
-                        suggested_replies=send_suggested_replies,
-                        content_type=cast(ContentType, content_type),
-                    )
-                    continue
-                elif event.event == "error":
-                    data = await self._load_json_dict(event.data, "error", message_id)
-                    if data.get("allow_retry", True):
-                        raise BotError(event.data)
+                    elif event_name == "done":
+                        # Don't send a report if we already told the bot about some other mistake.
+                        if (
+                            not state.got_text
+                            and not state.error_reported
+                            and not tools
+                        ):
+                            await self.report_error(
+                                "Bot returned no text in response",
+                                {"message_id": message_id},
+                            )
+                        return
                     else:
-                        raise BotErrorNoRetry(event.data)
-                elif event.event == "ping":
-                    # Not formally part of the spec, but FastAPI sends this; let's ignore it
-                    # instead of sending error reports.
-                    continue
-                else:
-                    # Truncate the type and message in case it's huge.
-                    await self.report_error(
-                        f"Unknown event type: {_safe_ellipsis(event.event, 100)}",
-                        {
-                            "event_data": _safe_ellipsis(event.data, 500),
-                            "message_id": message_id,
-                        },
-                    )
-                    error_reported = True
-                    continue
-                chunks.append(text)
-                yield BotMessage(
-                    text=text,
-                    raw_response={"type": event.event, "text": event.data},
-                    full_prompt=repr(request),
-                    is_replace_response=(event.event == "replace_response"),
-                )
+                        handler = event_handlers.get(
+                            event_name, _BotContext._handle_unknown_event
+                        )
+                        message = await handler(self, event, state)
+                        if message is not None:
+                            yield message
+                    # Only consulted by the meta handler; cheaper than counting events.
+                    state.is_first_event = False
+            finally:
+                await self._wait_for_background_reports()
         await self.report_error(
-            "Bot exited without sending 'done' event", {"message_id": message_id}
+            "Bot exited without sending 'done' event", {"message_id": state.message_id}
+        )
+
+    async def _handle_replace_response(
+        self, event: httpx_sse.ServerSentEvent, state: _QueryState
+    ) -> Optional[BotMessage]:
+        text = await self._get_single_json_field(
+            event.data, "replace_response", state.message_id
+        )
+        state.got_text = True
+        return BotMessage(
+            text=text,
+            raw_response=(
+                {"type": event.event, "text": event.data}
+                if state.with_raw_response
+                else None
+            ),
+            full_prompt=state.full_prompt,
+            is_replace_response=True,
+        )
+
+    async def _handle_suggested_reply(
+        self, event: httpx_sse.ServerSentEvent, state: _QueryState
+    ) -> Optional[BotMessage]:
+        text = await self._get_single_json_field(
+            event.data, "suggested_reply", state.message_id
+        )
+        return BotMessage(
+            text=text,
+            raw_response=(
+                {"type": event.event, "text": event.data}
+                if state.with_raw_response
+                else None
+            ),
+            full_prompt=state.full_prompt,
+            is_suggested_reply=True,
+        )
+
+    async def _handle_json(
+        self, event: httpx_sse.ServerSentEvent, state: _QueryState
+    ) -> Optional[BotMessage]:
+        return BotMessage(
+            text="",
+            data=cast(dict[str, Any], _json.loads(event.data)),
+            full_prompt=state.full_prompt,
+        )
+
+    async def _handle_meta(
+        self, event: httpx_sse.ServerSentEvent, state: _QueryState
+    ) -> Optional[BotMessage]:
+        if not state.is_first_event:
+            # spec says a meta event that is not the first event is ignored
+            return None
+        data = await self._load_json_dict(event.data, "meta", state.message_id)
+        try:
+            meta = _MetaEventData.model_validate(data)
+        except ValidationError as e:
+            # Report the first bad field, in the same shape as the bot server expects.
+            field_name = str(e.errors()[0]["loc"][0])
+            self._report_error_in_background(
+                f"Invalid {field_name} value in 'meta' event",
+                {"message_id": state.message_id, field_name: data.get(field_name)},
+            )
+            state.error_reported = True
+            return None
+        return MetaMessage(
+            text="",
+            raw_response=data,
+            full_prompt=state.full_prompt,
+            linkify=meta.linkify,
+            suggested_replies=meta.suggested_replies,
+            content_type=cast(ContentType, meta.content_type),
         )
 
+    async def _handle_error(
+        self, event: httpx_sse.ServerSentEvent, state: _QueryState
+    ) -> Optional[BotMessage]:
+        data = await self._load_json_dict(event.data, "error", state.message_id)
+        if data.get("allow_retry", True):
+            raise BotError(event.data)
+        else:
+            raise BotErrorNoRetry(event.data)
+
+    async def _ignore_event(
+        self, event: httpx_sse.ServerSentEvent, state: _QueryState
+    ) -> Optional[BotMessage]:
+        return None
+
+    async def _handle_unknown_event(
+        self, event: httpx_sse.ServerSentEvent, state: _QueryState
+    ) -> Optional[BotMessage]:
+        # Truncate the type and message in case it's huge.
+        self._report_error_in_background(
+            f"Unknown event type: {_safe_ellipsis_str(event.event, 100)}",
+            {
+                "event_data": _safe_ellipsis_str(event.data, 500),
+                "message_id": state.message_id,
+            },
+        )
+        state.error_reported = True
+        return None
+
+    # Handlers for every event type other than "text" and "done", which
+    # perform_query_request handles inline. Built once here rather than per request.
+    _event_handlers: ClassVar[dict[str, _EventHandler]] = {
+        "replace_response": _handle_replace_response,
+        "suggested_reply": _handle_suggested_reply,
+        "json": _handle_json,
+        "meta": _handle_meta,
+        "error": _handle_error,
+        # Not formally part of the spec, but FastAPI sends this; let's ignore it
+        # instead of sending error reports.
+        "ping": _ignore_event,
+    }
+
     async def _get_single_json_field(
         self, data: str, context: str, message_id: Identifier, field: str = "text"
     ) -> str:
         data_dict = await self._load_json_dict(data, context, message_id)
-        text = data_dict[field]
+        try:
+            text = data_dict[field]
+        except KeyError:
+            await self.report_error(
+                f"Missing '{field}' field in '{context}' event",
+                {"data": data_dict, "message_id": message_id},
+            )
+            raise BotErrorNoRetry(
+                f"Missing '{field}' field in '{context}' event"
+            ) from None
         if not isinstance(text, str):
             await self.report_error(
                 f"Expected string in '{field}' field for '{context}' event",
@@ -294,7 +443,7 @@ class _BotContext:
         self, data: str, context: str, message_id: Identifier
     ) -> dict[str, object]:
         try:
-            parsed = json.loads(data)
+            parsed = _json.loads(data)
         except json.JSONDecodeError:
             await self.report_error(
                 f"Invalid JSON in {context!r} event",
@@ -302,7 +451,8 @@ class _BotContext:
             )
             # If they are returning invalid JSON, retrying immediately probably won't help
             raise BotErrorNoRetry(f"Invalid JSON in {context!r} event") from None
-        if not isinstance(parsed, dict):
+        # An exact type check is enough here: JSON objects always decode to a plain dict.
+        if parsed.__class__ is not dict:
             await self.report_error(
                 f"Expected JSON dict in {context!r} event",
                 {"data": data, "message_id": message_id},
@@ -311,6 +461,157 @@ class _BotContext:
         return cast(dict[str, object], parsed)
 
 
+def _build_query_payload(
+    request: QueryRequest,
+    tools: Optional[list[ToolDefinition]],
+    tool_calls: Optional[list[ToolCallDefinition]],
+    tool_results: Optional[list[ToolResultDefinition]],
+) -> dict[str, Any]:
+    payload = request.model_dump()
+    if tools is not None:
+        payload["tools"] = [tool.model_dump() for tool in tools]
+    if tool_calls is not None:
+        payload["tool_calls"] = [tool_call.model_dump() for tool_call in tool_calls]
+    if tool_results is not None:
+        payload["tool_results"] = [
+            tool_result.model_dump() for tool_result in tool_results
+        ]
+    return payload
+
+
+# Set to True (before the first request) to use HTTP/2 for the shared client that queries,
+# attachment uploads and cost requests use when no session is passed. It needs the optional
+# h2 package (`pip install fastapi_poe[http2]`). Off by default, because with HTTP/2 all
+# concurrent streams share one connection and its flow-control window.
+USE_HTTP2 = False
+
+# One client per event loop: httpx connections are bound to the loop that opened them, so
+# sharing a client across loops (for example across asyncio.run() calls) would break.
+_shared_sessions: (
+    "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]"
+) = weakref.WeakKeyDictionary()
+
+
+def _cookieless_jar() -> http.cookiejar.CookieJar:
+    # Shared clients make requests on behalf of many bots, API keys and users, so a cookie
+    # set by one response must never be sent with another's request. An empty allow-list
+    # makes the jar reject every cookie.
+    return http.cookiejar.CookieJar(
+        policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[])
+    )
+
+
+def _get_shared_session() -> httpx.AsyncClient:
+    """Return the client used when the caller does not pass a session.
+
+    Reusing it across requests keeps connections alive, so repeated queries skip the TCP and
+    TLS handshakes. The client is dropped along with its event loop.
+
+    """
+    loop = asyncio.get_running_loop()
+    session = _shared_sessions.get(loop)
+    if session is None or session.is_closed:
+        session = httpx.AsyncClient(
+            timeout=600,
+            limits=httpx.Limits(max_keepalive_connections=100, keepalive_expiry=30),
+            http2=USE_HTTP2,
+            cookies=_cookieless_jar(),
+        )
+        _shared_sessions[loop] = session
+    return session
+
+
+# Flush coalesced text once it reaches this many characters, even inside the window.
+_COALESCE_MAX_CHARS = 4096
+
+
+def _is_plain_text_message(message: BotMessage) -> bool:
+    return (
+        type(message) is BotMessage
+        and message.data is None
+        and not message.is_replace_response
+        and not message.is_suggested_reply
+    )
+
+
+def _merge_text_messages(messages: list[BotMessage]) -> BotMessage:
+    if len(messages) == 1:
+        return messages[0]
+    raw_responses = [message.raw_response for message in messages]
+    return BotMessage(
+        text="".join(message.text for message in messages),
+        raw_response=(
+            None if all(raw is None for raw in raw_responses) else raw_responses
+        ),
+        full_prompt=messages[0].full_prompt,
+    )
+
+
+async def _coalesce_text_messages(
+    messages: AsyncGenerator[BotMessage, None], window: float
+) -> AsyncGenerator[BotMessage, None]:
+    """Merges runs of plain text messages that arrive within `window` seconds.
+
+    Buffered text is flushed as soon as the window since its first chunk expires (even if no
+    new message has arrived), when the size limit is reached, when any other kind of message
+    arrives, and at the end of the stream.
+
+    """
+    loop = asyncio.get_running_loop()
+    iterator = messages.__aiter__()
+    pending: list[BotMessage] = []
+    pending_chars = 0
+    deadline = 0.0
+    # Only used while text is buffered, so that waiting for the next message can time out
+    # without cancelling the read from the underlying stream.
+    next_message: Optional["asyncio.Future[BotMessage]"] = None
+    try:
+        while True:
+            try:
+                if next_message is None and not pending:
+                    message = await iterator.__anext__()
+                else:
+                    if next_message is None:
+                        next_message = asyncio.ensure_future(iterator.__anext__())
+                    if pending:
+                        done, _ = await asyncio.wait(
+                            (next_message,), timeout=deadline - loop.time()
+                        )
+                        if not done:
+                            yield _merge_text_messages(pending)
+                            pending = []
+                            pending_chars = 0
+                            continue
+                    future, next_message = next_message, None
+                    message = await future
+            except StopAsyncIteration:
+                break
+            if _is_plain_text_message(message):
+                if pending and loop.time() >= deadline:
+                    yield _merge_text_messages(pending)
+                    pending = []
+                    pending_chars = 0
+                if not pending:
+                    deadline = loop.time() + window
+                pending.append(message)
+                pending_chars += len(message.text)
+                if pending_chars >= _COALESCE_MAX_CHARS:
+                    yield _merge_text_messages(pending)
+                    pending = []
+                    pending_chars = 0
+                continue
+            if pending:
+                yield _merge_text_messages(pending)
+                pending = []
+                pending_chars = 0
+            yield message
+    finally:
+        if next_message is not None:
+            next_message.cancel()
+    if pending:
+        yield _merge_text_messages(pending)
+
+
 def _default_error_handler(e: Exception, msg: str) -> None:
     print("Error in Poe bot:", msg, "\n", repr(e))
 
@@ -329,6 +630,7 @@ async def stream_request(
     num_tries: int = 2,
     retry_sleep_time: float = 0.5,
     base_url: str = "https://api.poe.com/bot/",
+    coalesce_window_ms: float = 0,
 ) -> AsyncGenerator[BotMessage, None]:
     """
 
@@ -347,6 +649,12 @@ async def stream_request(
     the functions you have. This is used for OpenAI function calling.
     - tool_executables: (`Optional[list[Callable]] = None`): An list of functions corresponding
     to the ToolDefinitions. This is used for OpenAI function calling.
+    - `coalesce_window_ms` (`float = 0`): If positive, consecutive text chunks that arrive
+    within this many milliseconds of the first buffered chunk are merged into a single message,
+    which cuts per-message overhead for bots that stream one token at a time. Buffered text is
+    never held back for longer than the window. Merged messages carry the
+    list of the original `raw_response` values. The default of `0` disables merging, so every
+    chunk is yielded as it arrives.
 
     """
     tool_calls = None
@@ -383,6 +691,7 @@ async def stream_request(
         num_tries=num_tries,
         retry_sleep_time=retry_sleep_time,
         base_url=base_url,
+        coalesce_window_ms=coalesce_window_ms,
     ):
         yield message
 
@@ -390,28 +699,41 @@ async def stream_request(
 async def _get_tool_results(
     tool_executables: list[Callable], tool_calls: list[ToolCallDefinition]
 ) -> list[ToolResultDefinition]:
+    # Classify each executable once rather than once per call.
     tool_executables_dict = {
-        executable.__name__: executable for executable in tool_executables
+        executable.__name__: (executable, inspect.iscoroutinefunction(executable))
+        for executable in tool_executables
     }
-    tool_results = []
-    for tool_call in tool_calls:
-        tool_call_id = tool_call.id
-        name = tool_call.function.name
-        arguments = json.loads(tool_call.function.arguments)
-        _func = tool_executables_dict[name]
-        if inspect.iscoroutinefunction(_func):
-            content = await _func(**arguments)
-        else:
-            content = _func(**arguments)
-        tool_results.append(
-            ToolResultDefinition(
-                role="tool",
-                tool_call_id=tool_call_id,
-                name=name,
-                content=json.dumps(content),
-            )
+    # Look everything up before creating any coroutines, so a bad tool call can't leave
+    # some of them un-awaited.
+    calls = [
+        (
+            *tool_executables_dict[tool_call.function.name],
+            json.loads(tool_call.function.arguments),
+        )
+        for tool_call in tool_calls
+    ]
+    # The tool calls are independent of each other, so run them all at once. Synchronous
+    # executables go to a worker thread so they don't block the event loop.
+    pending = [
+        (
+            _func(**arguments)
+            if is_coroutine_function
+            else asyncio.to_thread(_func, **arguments)
+        )
+        for _func, is_coroutine_function, arguments in calls
+    ]
+    contents = await asyncio.gather(*pending)
+    return [
+        ToolResultDefinition(
+            role="tool",
+            tool_call_id=tool_call.id,
+            name=tool_call.function.name,
+            # Tool output can be large, so use the faster encoder when available.
+            content=_json.dumps(content).decode(),
         )
-    return tool_results
+        for tool_call, content in zip(tool_calls, contents)
+    ]
 
 
 async def _get_tool_calls(
@@ -428,7 +750,12 @@ async def _get_tool_calls(
     retry_sleep_time: float = 0.5,
     base_url: str = "https://api.poe.com/bot/",
 ) -> list[ToolCallDefinition]:
-    tool_call_object_dict: dict[int, dict[str, Any]] = {}
+    # Tool calls arrive with small indices counting up from 0, so a list indexed by position
+    # keeps them in order without sorting at the end.
+    tool_call_objects: list[Optional[dict[str, Any]]] = []
+    # Argument deltas for each tool call, joined once at the end instead of concatenated
+    # per delta, which would be quadratic in the number of deltas.
+    argument_fragments: list[list[str]] = []
     async for message in stream_request_base(
         request=request,
         bot_name=bot_name,
@@ -454,23 +781,23 @@ async def _get_tool_calls(
                         "tool_calls"
                     ][0]
                     index = tool_call_object.pop("index")
-                    if index not in tool_call_object_dict:
-                        tool_call_object_dict[index] = tool_call_object
-                    else:
-                        function_info = tool_call_object["function"]
-                        tool_call_object_dict[index]["function"][
-                            "arguments"
-                        ] += function_info["arguments"]
+                    if index >= len(tool_call_objects):
+                        missing = index + 1 - len(tool_call_objects)
+                        tool_call_objects.extend([None] * missing)
+                        argument_fragments.extend([] for _ in range(missing))
+                    arguments = tool_call_object["function"]["arguments"]
+                    if tool_call_objects[index] is None:
+                        tool_call_objects[index] = tool_call_object
+                    argument_fragments[index].append(arguments)
                 except KeyError:
                     continue
-    tool_call_object_list = [
-        tool_call_object
-        for index, tool_call_object in sorted(tool_call_object_dict.items())
-    ]
-    return [
-        ToolCallDefinition(**tool_call_object)
-        for tool_call_object in tool_call_object_list
-    ]
+    tool_call_list = []
+    for tool_call_object, fragments in zip(tool_call_objects, argument_fragments):
+        if tool_call_object is None:
+            continue
+        tool_call_object["function"]["arguments"] = "".join(fragments)
+        tool_call_list.append(ToolCallDefinition(**tool_call_object))
+    return tool_call_list
 
 
 async def stream_request_base(
@@ -488,6 +815,8 @@ async def stream_request_base(
     num_tries: int = 2,
     retry_sleep_time: float = 0.5,
     base_url: str = "https://api.poe.com/bot/",
+    with_raw_response: bool = True,
+    coalesce_window_ms: float = 0,
 ) -> AsyncGenerator[BotMessage, None]:
     if access_key != "":
         warnings.warn(
@@ -496,43 +825,45 @@ async def stream_request_base(
             stacklevel=access_key_deprecation_warning_stacklevel,
         )
 
-    async with contextlib.AsyncExitStack() as stack:
-        if session is None:
-            session = await stack.enter_async_context(httpx.AsyncClient(timeout=600))
-        url = f"{base_url}{bot_name}"
-        ctx = _BotContext(
-            endpoint=url, api_key=api_key, session=session, on_error=on_error
-        )
-        got_response = False
-        for i in range(num_tries):
-            try:
-                async for message in ctx.perform_query_request(
-                    request=request,
-                    tools=tools,
-                    tool_calls=tool_calls,
-                    tool_results=tool_results,
-                ):
-                    got_response = True
-                    yield message
-                break
-            except BotErrorNoRetry:
-                raise
-            except Exception as e:
-                on_error(e, f"Bot request to {bot_name} failed on try {i}")
-                # Want to retry on some errors even if we have streamed part of the request
-                # RemoteProtocolError: peer closed connection without sending complete message body
-                allow_retry_after_response = isinstance(e, httpx.RemoteProtocolError)
-                if (
-                    got_response and not allow_retry_after_response
-                ) or i == num_tries - 1:
-                    # If it's a BotError, it probably has a good error message
-                    # that we want to show directly.
-                    if isinstance(e, BotError):
-                        raise
-                    # But if it's something else (maybe an HTTP error or something),
-                    # wrap it in a BotError that makes it clear which bot is broken.
-                    raise BotError(f"Error communicating with bot {bot_name}") from e
-                await asyncio.sleep(retry_sleep_time)
+    if session is None:
+        session = _get_shared_session()
+    url = f"{base_url}{bot_name}"
+    ctx = _BotContext(endpoint=url, api_key=api_key, session=session, on_error=on_error)
+    # The body is the same for every attempt, so only serialize it once.
+    content = _json.dumps(
+        _build_query_payload(request, tools, tool_calls, tool_results)
+    )
+    got_response = False
+    for i in range(num_tries):
+        try:
+            messages = ctx.perform_query_request(
+                request=request,
+                content=content,
+                tools=tools,
+                with_raw_response=with_raw_response,
+            )
+            if coalesce_window_ms > 0:
+                messages = _coalesce_text_messages(messages, coalesce_window_ms / 1000)
+            async for message in messages:
+                got_response = True
+                yield message
+            break
+        except BotErrorNoRetry:
+            raise
+        except Exception as e:
+            on_error(e, f"Bot request to {bot_name} failed on try {i}")
+            # Want to retry on some errors even if we have streamed part of the request
+            # RemoteProtocolError: peer closed connection without sending complete message body
+            allow_retry_after_response = isinstance(e, httpx.RemoteProtocolError)
+            if (got_response and not allow_retry_after_response) or i == num_tries - 1:
+                # If it's a BotError, it probably has a good error message
+                # that we want to show directly.
+                if isinstance(e, BotError):
+                    raise
+                # But if it's something else (maybe an HTTP error or something),
+                # wrap it in a BotError that makes it clear which bot is broken.
+                raise BotError(f"Error communicating with bot {bot_name}") from e
+            await asyncio.sleep(retry_sleep_time)
 
 
 def get_bot_response(
@@ -616,7 +947,11 @@ async def get_final_response(
 
     """
     chunks: list[str] = []
-    async for message in stream_request(
+    # This loop runs once per token, so keep the common path (plain text) short.
+    append_chunk = chunks.append
+    # No tools are involved, so go straight to stream_request_base. We only need the text, so
+    # skip building a raw_response dict for every event.
+    async for message in stream_request_base(
         request,
         bot_name,
         api_key,
@@ -627,19 +962,31 @@ async def get_final_response(
         num_tries=num_tries,
         retry_sleep_time=retry_sleep_time,
         base_url=base_url,
+        with_raw_response=False,
     ):
-        if isinstance(message, MetaMessage):
-            continue
-        if message.is_suggested_reply:
+        if message.is_suggested_reply or isinstance(message, MetaMessage):
             continue
         if message.is_replace_response:
             chunks.clear()
-        chunks.append(message.text)
+        append_chunk(message.text)
     if not chunks:
         raise BotError(f"Bot {bot_name} sent no response")
     return "".join(chunks)
 
 
+_sync_client: Optional[httpx.Client] = None
+
+
+def _get_sync_client() -> httpx.Client:
+    # Shared so that syncing several bots in a row reuses the same connection. httpx.Client
+    # is thread-safe, and the default timeout matches what httpx.post() used.
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = httpx.Client(cookies=_cookieless_jar())
+        atexit.register(_sync_client.close)
+    return _sync_client
+
+
 def sync_bot_settings(
     bot_name: str,
     access_key: str = "",
@@ -650,12 +997,12 @@ def sync_bot_settings(
     """Fetch settings from the running bot server, and then sync them with Poe."""
     try:
         if settings is None:
-            response = httpx.post(
+            response = _get_sync_client().post(
                 f"{base_url}fetch_settings/{bot_name}/{access_key}/{PROTOCOL_VERSION}"
             )
         else:
             headers = {"Content-Type": "application/json"}
-            response = httpx.post(
+            response = _get_sync_client().post(
                 f"{base_url}update_settings/{bot_name}/{access_key}/{PROTOCOL_VERSION}",
                 headers=headers,
                 json=settings,
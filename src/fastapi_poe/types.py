@@ -1,3 +1,4 @@
+from dataclasses import dataclass
 from typing import Any, Optional
 
 from fastapi import Request
@@ -9,6 +10,10 @@ FeedbackType: TypeAlias = Literal["like", "dislike"]
 ContentType: TypeAlias = Literal["text/markdown", "text/plain"]
 ErrorType: TypeAlias = Literal["user_message_too_long", "insufficient_fund"]
 
+# For models that most bots never use, or use once per process: build their validators on
+# first use rather than at import time.
+_DEFER_BUILD = ConfigDict(defer_build=True)
+
 
 class MessageFeedback(BaseModel):
     """
@@ -82,10 +87,10 @@ class ProtocolMessage(BaseModel):
     attachments: list[Attachment] = Field(default_factory=list)
 
 
-class RequestContext(BaseModel):
-    class Config:
-        arbitrary_types_allowed = True
-
+@dataclass
+class RequestContext:
+    # A plain dataclass rather than a pydantic model: one is created for every HTTP request,
+    # and there is nothing to validate since we build it ourselves from FastAPI's Request.
     http_request: Request
 
 
@@ -129,8 +134,8 @@ class QueryRequest(BaseRequest):
     access_key: str = "<missing>"
     temperature: Optional[float] = None
     skip_system_prompt: bool = False
-    logit_bias: dict[str, float] = {}
-    stop_sequences: list[str] = []
+    logit_bias: dict[str, float] = Field(default_factory=dict)
+    stop_sequences: list[str] = Field(default_factory=list)
     language_code: str = "en"
     bot_query_id: Identifier = ""
 
@@ -143,6 +148,8 @@ class SettingsRequest(BaseRequest):
 
     """
 
+    model_config = _DEFER_BUILD
+
 
 class ReportFeedbackRequest(BaseRequest):
     """
@@ -156,6 +163,8 @@ class ReportFeedbackRequest(BaseRequest):
 
     """
 
+    model_config = _DEFER_BUILD
+
     message_id: Identifier
     user_id: Identifier
     conversation_id: Identifier
@@ -174,6 +183,8 @@ class ReportReactionRequest(BaseRequest):
 
     """
 
+    model_config = _DEFER_BUILD
+
     message_id: Identifier
     user_id: Identifier
     conversation_id: Identifier
@@ -190,6 +201,8 @@ class ReportErrorRequest(BaseRequest):
 
     """
 
+    model_config = _DEFER_BUILD
+
     message: str
     metadata: dict[str, Any]
 
@@ -218,7 +231,7 @@ class SettingsResponse(BaseModel):
 
     """
 
-    model_config = ConfigDict(extra="forbid")
+    model_config = ConfigDict(extra="forbid", defer_build=True)
 
     context_clear_window_secs: Optional[int] = None  # deprecated
     allow_user_context_clear: Optional[bool] = None  # deprecated
@@ -233,6 +246,8 @@ class SettingsResponse(BaseModel):
 
 
 class AttachmentUploadResponse(BaseModel):
+    model_config = _DEFER_BUILD
+
     inline_ref: Optional[str]
     attachment_url: Optional[str]
 
@@ -335,6 +350,8 @@ class ToolDefinition(BaseModel):
 
     """
 
+    model_config = _DEFER_BUILD
+
     class FunctionDefinition(BaseModel):
         class ParametersDefinition(BaseModel):
             type: str
@@ -362,6 +379,8 @@ class ToolCallDefinition(BaseModel):
 
     """
 
+    model_config = _DEFER_BUILD
+
     class FunctionDefinition(BaseModel):
         name: str
         arguments: str
@@ -384,6 +403,8 @@ class ToolResultDefinition(BaseModel):
 
     """
 
+    model_config = _DEFER_BUILD
+
     role: str
     name: str
     tool_call_id: str
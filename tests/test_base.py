@@ -0,0 +1,202 @@
+import asyncio
+import functools
+import json
+from collections.abc import AsyncIterable
+from typing import Callable, Optional, cast
+
+import httpx
+import pytest
+from fastapi import Request
+from fastapi_poe import _json, base
+from fastapi_poe.base import PoeBot, _encode_multipart_file
+from fastapi_poe.client import get_final_response
+from fastapi_poe.types import (
+    PartialResponse,
+    ProtocolMessage,
+    QueryRequest,
+    RequestContext,
+)
+
+
+@pytest.mark.parametrize(
+    ("filename", "content_type"),
+    [("image.png", None), ('we"ird\\name.txt', "text/plain"), ("noext", None)],
+)
+def test_encode_multipart_file_matches_httpx(
+    filename: str, content_type: Optional[str]
+) -> None:
+    fields = {"message_id": "m1", "is_inline": "true"}
+    body, multipart_content_type = _encode_multipart_file(
+        fields=fields,
+        filename=filename,
+        file_data=b"\x00data",
+        content_type=content_type,
+    )
+    file_tuple = (
+        (filename, b"\x00data")
+        if content_type is None
+        else (filename, b"\x00data", content_type)
+    )
+    expected = httpx.Request(
+        "POST",
+        "https://example.com/",
+        data=fields,
+        files={"file": file_tuple},
+        headers={"Content-Type": multipart_content_type},
+    )
+    assert body == expected.read()
+
+
+@pytest.mark.parametrize("wrap", [bytearray, memoryview])
+def test_encode_multipart_file_accepts_buffers(wrap: type) -> None:
+    body, multipart_content_type = _encode_multipart_file(
+        fields={"message_id": "m1"},
+        filename="a.bin",
+        file_data=wrap(b"\x00data"),
+        content_type=None,
+    )
+    boundary = multipart_content_type.split("boundary=")[1]
+    assert body.endswith(b"\x00data\r\n--%s--\r\n" % boundary.encode())
+
+
+def test_text_event_escapes_line_separators() -> None:
+    text = 'naïve "quote"\n line\u2028separator\u2029paragraph\x85next'
+    data = PoeBot.text_event(text).data
+    assert isinstance(data, str)
+    assert json.loads(data) == {"text": text}
+    # Nothing in the payload may look like a line break to an SSE client.
+    assert data.splitlines() == [data]
+
+
+@pytest.mark.parametrize("dumps", [_json.dumps, _json._fallback_dumps])
+def test_dumps_escapes_lone_surrogates(dumps: Callable[[object], bytes]) -> None:
+    assert json.loads(dumps({"text": "a\ud800b"})) == {"text": "a\ud800b"}
+
+
+def test_text_event_with_lone_surrogate() -> None:
+    data = PoeBot.text_event("a\ud800b").data
+    assert json.loads(str(data)) == {"text": "a\ud800b"}
+
+
+def test_scheduled_attachment_finishes_before_response_ends(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    uploaded = asyncio.Event()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0.01)
+        uploaded.set()
+        return httpx.Response(200, json={"inline_ref": "ref", "attachment_url": None})
+
+    session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(base, "_get_shared_session", lambda: session)
+
+    class AttachmentBot(PoeBot):
+        async def get_response(
+            self, request: QueryRequest
+        ) -> AsyncIterable[PartialResponse]:
+            self.schedule_message_attachment(
+                message_id=request.message_id, file_data=b"data", filename="a.txt"
+            )
+            # The upload runs in the background while the bot keeps streaming.
+            yield PartialResponse(text=str(uploaded.is_set()))
+
+    async def run() -> list[tuple[str, object]]:
+        bot = AttachmentBot(access_key="k" * 32)
+        request = QueryRequest(
+            query=[ProtocolMessage(role="user", content="hello")],
+            user_id="",
+            conversation_id="",
+            message_id="m",
+            version="1.0",
+            type="query",
+        )
+        context = RequestContext(http_request=cast(Request, None))
+        return [
+            (str(event.event), json.loads(str(event.data)))
+            async for event in bot.handle_query(request, context)
+        ]
+
+    assert asyncio.run(run()) == [("text", {"text": "False"}), ("done", {})]
+    assert uploaded.is_set()
+
+
+def test_failed_scheduled_attachment_is_reported(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(500, text="upload failed")
+
+    session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(base, "_get_shared_session", lambda: session)
+
+    class AttachmentBot(PoeBot):
+        async def get_response(
+            self, request: QueryRequest
+        ) -> AsyncIterable[PartialResponse]:
+            self.schedule_message_attachment(
+                message_id=request.message_id, file_data=b"data", filename="a.txt"
+            )
+            # Let the upload fail before the bot finishes its response.
+            await asyncio.sleep(0.01)
+            yield PartialResponse(text="done")
+
+    async def run() -> list[str]:
+        bot = AttachmentBot(access_key="k" * 32)
+        request = QueryRequest(
+            query=[ProtocolMessage(role="user", content="hello")],
+            user_id="",
+            conversation_id="",
+            message_id="m",
+            version="1.0",
+            type="query",
+        )
+        context = RequestContext(http_request=cast(Request, None))
+        return [str(event.event) async for event in bot.handle_query(request, context)]
+
+    assert asyncio.run(run()) == ["text", "error", "done"]
+
+
+def test_attachment_cookies_do_not_reach_queries(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    cookie_headers: list[Optional[str]] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        cookie_headers.append(request.headers.get("Cookie"))
+        if request.url.host == "www.quora.com":
+            return httpx.Response(
+                200, headers={"Set-Cookie": "upload=a"}, json={"inline_ref": "ref"}
+            )
+        return httpx.Response(
+            200,
+            headers={"Content-Type": "text/event-stream", "Set-Cookie": "query=b"},
+            content=b'event: text\ndata: {"text": "Hi"}\n\nevent: done\ndata: {}\n\n',
+        )
+
+    monkeypatch.setattr(
+        httpx,
+        "AsyncClient",
+        functools.partial(httpx.AsyncClient, transport=httpx.MockTransport(handler)),
+    )
+    request = QueryRequest(
+        query=[ProtocolMessage(role="user", content="hello")],
+        user_id="",
+        conversation_id="",
+        message_id="m",
+        version="1.0",
+        type="query",
+    )
+
+    async def run() -> None:
+        bot = PoeBot(access_key="k" * 32)
+        await bot.post_message_attachment(
+            message_id="m", file_data=b"data", filename="a.txt"
+        )
+        await get_final_response(request, "OtherBot", api_key="key")
+        await bot.post_message_attachment(
+            message_id="m", file_data=b"data", filename="a.txt"
+        )
+
+    asyncio.run(run())
+    assert cookie_headers == [None, None, None]
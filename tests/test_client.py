@@ -0,0 +1,450 @@
+import asyncio
+import functools
+import json
+import math
+from collections.abc import AsyncIterator
+from typing import Callable, Optional
+
+import httpx
+import pytest
+from fastapi_poe import _json, client
+from fastapi_poe.base import PoeBot
+from fastapi_poe.client import (
+    BotErrorNoRetry,
+    _get_tool_calls,
+    _get_tool_results,
+    get_final_response,
+    stream_request,
+    stream_request_base,
+)
+from fastapi_poe.types import MetaResponse as MetaMessage
+from fastapi_poe.types import PartialResponse as BotMessage
+from fastapi_poe.types import (
+    ProtocolMessage,
+    QueryRequest,
+    ToolCallDefinition,
+    ToolDefinition,
+)
+
+
+def _make_request() -> QueryRequest:
+    return QueryRequest(
+        query=[ProtocolMessage(role="user", content="hello")],
+        user_id="",
+        conversation_id="",
+        message_id="",
+        version="1.0",
+        type="query",
+    )
+
+
+def _sse_body(events: list[tuple[str, object]]) -> bytes:
+    return "".join(
+        f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        for event, data in events
+    ).encode()
+
+
+def _mock_session(
+    events: list[tuple[str, object]], *, chunk_size: Optional[int] = None
+) -> httpx.AsyncClient:
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = _sse_body(events)
+        if chunk_size is None:
+            return httpx.Response(
+                200, headers={"Content-Type": "text/event-stream"}, content=body
+            )
+
+        size = chunk_size
+
+        async def stream() -> AsyncIterator[bytes]:
+            for start in range(0, len(body), size):
+                yield body[start : start + size]
+
+        return httpx.Response(
+            200, headers={"Content-Type": "text/event-stream"}, content=stream()
+        )
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def test_get_final_response() -> None:
+    session = _mock_session(
+        [
+            ("meta", {"content_type": "text/markdown"}),
+            ("text", {"text": "Hello"}),
+            ("text", {"text": " world"}),
+            ("suggested_reply", {"text": "What else?"}),
+            ("done", {}),
+        ]
+    )
+    response = asyncio.run(
+        get_final_response(_make_request(), "TestBot", session=session)
+    )
+    assert response == "Hello world"
+
+
+def test_get_final_response_replace_response() -> None:
+    session = _mock_session(
+        [
+            ("text", {"text": "draft"}),
+            ("replace_response", {"text": "final"}),
+            ("text", {"text": " answer"}),
+            ("done", {}),
+        ]
+    )
+    response = asyncio.run(
+        get_final_response(_make_request(), "TestBot", session=session)
+    )
+    assert response == "final answer"
+
+
+def test_get_final_response_with_lone_surrogate_from_server() -> None:
+    # PoeBot escapes lone surrogates, and the client must be able to read them back.
+    data = PoeBot.text_event("a\ud800b").data
+    body = f"event: text\ndata: {data}\n\nevent: done\ndata: {{}}\n\n".encode()
+    session = httpx.AsyncClient(
+        transport=httpx.MockTransport(
+            lambda request: httpx.Response(
+                200, headers={"Content-Type": "text/event-stream"}, content=body
+            )
+        )
+    )
+    response = asyncio.run(
+        get_final_response(_make_request(), "TestBot", session=session)
+    )
+    assert response == "a\ud800b"
+
+
+def test_json_event_with_nan_literal() -> None:
+    async def collect() -> list[BotMessage]:
+        session = _mock_session([("json", {"value": float("nan")}), ("done", {})])
+        return [
+            message
+            async for message in stream_request_base(
+                _make_request(), "TestBot", session=session
+            )
+        ]
+
+    [message] = asyncio.run(collect())
+    assert message.data is not None
+    assert math.isnan(message.data["value"])
+
+
+def test_query_body_includes_every_field() -> None:
+    bodies: list[dict[str, object]] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        bodies.append(json.loads(request.content))
+        return httpx.Response(
+            200,
+            headers={"Content-Type": "text/event-stream"},
+            content=_sse_body([("text", {"text": "Hi"}), ("done", {})]),
+        )
+
+    request = _make_request().model_copy(update={"skip_system_prompt": False})
+    session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    asyncio.run(get_final_response(request, "TestBot", session=session))
+    [body] = bodies
+    # Default-valued fields are sent too, including ones the caller set explicitly.
+    assert body == json.loads(json.dumps(request.model_dump()))
+    assert body["skip_system_prompt"] is False
+    assert body["query"] == [ProtocolMessage(role="user", content="hello").model_dump()]
+
+
+def test_get_final_response_missing_text_field() -> None:
+    session = _mock_session([("text", {"not_text": "Hello"}), ("done", {})])
+    with pytest.raises(BotErrorNoRetry):
+        asyncio.run(
+            get_final_response(
+                _make_request(), "TestBot", session=session, on_error=lambda e, m: None
+            )
+        )
+
+
+def _tool_call_delta(index: int, **tool_call: object) -> dict[str, object]:
+    return {
+        "choices": [
+            {
+                "delta": {"tool_calls": [{"index": index, **tool_call}]},
+                "finish_reason": None,
+            }
+        ]
+    }
+
+
+def test_get_tool_calls_assembles_argument_deltas() -> None:
+    session = _mock_session(
+        [
+            (
+                "json",
+                _tool_call_delta(
+                    0,
+                    id="call_a",
+                    type="function",
+                    function={"name": "get_weather", "arguments": '{"city": '},
+                ),
+            ),
+            (
+                "json",
+                _tool_call_delta(
+                    1,
+                    id="call_b",
+                    type="function",
+                    function={"name": "get_time", "arguments": "{}"},
+                ),
+            ),
+            ("json", _tool_call_delta(0, function={"arguments": '"Paris"}'})),
+            ("json", {"choices": [{"delta": {}, "finish_reason": "tool_calls"}]}),
+            ("done", {}),
+        ]
+    )
+    tool = ToolDefinition.model_validate(
+        {
+            "type": "function",
+            "function": {
+                "name": "get_weather",
+                "description": "",
+                "parameters": {"type": "object", "properties": {}},
+            },
+        }
+    )
+    tool_calls = asyncio.run(
+        _get_tool_calls(_make_request(), "TestBot", tools=[tool], session=session)
+    )
+    assert [
+        (tool_call.id, tool_call.function.name, tool_call.function.arguments)
+        for tool_call in tool_calls
+    ] == [("call_a", "get_weather", '{"city": "Paris"}'), ("call_b", "get_time", "{}")]
+
+
+def test_get_tool_results_runs_sync_and_async_tools() -> None:
+    def get_weather(city: str) -> str:
+        return f"Sunny in {city}"
+
+    async def get_time() -> str:
+        return "noon"
+
+    tool_calls = [
+        ToolCallDefinition.model_validate(
+            {
+                "id": "call_a",
+                "type": "function",
+                "function": {"name": "get_weather", "arguments": '{"city": "Paris"}'},
+            }
+        ),
+        ToolCallDefinition.model_validate(
+            {
+                "id": "call_b",
+                "type": "function",
+                "function": {"name": "get_time", "arguments": "{}"},
+            }
+        ),
+    ]
+    tool_results = asyncio.run(
+        _get_tool_results(
+            tool_executables=[get_time, get_weather], tool_calls=tool_calls
+        )
+    )
+    assert [(result.tool_call_id, result.content) for result in tool_results] == [
+        ("call_a", '"Sunny in Paris"'),
+        ("call_b", '"noon"'),
+    ]
+
+
+@pytest.mark.parametrize("dumps", [_json.dumps, _json._fallback_dumps])
+def test_dumps_encodes_non_finite_floats_as_null(
+    dumps: Callable[[object], bytes]
+) -> None:
+    value = {"a": float("nan"), "b": [float("inf"), (float("-inf"), 1.5)]}
+    assert json.loads(dumps(value)) == {"a": None, "b": [None, [None, 1.5]]}
+    # Non-finite floats next to a lone surrogate go through the json.dumps() fallback.
+    assert json.loads(dumps({"a": float("nan"), "b": "\ud800"})) == {
+        "a": None,
+        "b": "\ud800",
+    }
+
+
+@pytest.mark.parametrize("loads", [_json.loads, _json._fallback_loads])
+def test_loads_matches_json_loads(loads: Callable[[bytes], object]) -> None:
+    assert loads(b'{"text": "a\\ud800b"}') == {"text": "a\ud800b"}
+    parsed = loads(b'{"a": NaN, "b": -Infinity}')
+    assert isinstance(parsed, dict)
+    assert math.isnan(parsed["a"])
+    assert parsed["b"] == float("-inf")
+    with pytest.raises(json.JSONDecodeError):
+        loads(b'{"text": ')
+
+
+def test_get_tool_results_with_non_finite_floats() -> None:
+    def get_ratio() -> float:
+        return float("nan")
+
+    tool_call = ToolCallDefinition.model_validate(
+        {
+            "id": "call_a",
+            "type": "function",
+            "function": {"name": "get_ratio", "arguments": "{}"},
+        }
+    )
+    tool_results = asyncio.run(
+        _get_tool_results(tool_executables=[get_ratio], tool_calls=[tool_call])
+    )
+    assert tool_results[0].content == "null"
+
+
+def test_invalid_meta_event_is_reported() -> None:
+    errors: list[str] = []
+    session = _mock_session(
+        [
+            ("meta", {"linkify": True, "suggested_replies": "yes"}),
+            ("text", {"text": "Hello"}),
+            ("done", {}),
+        ]
+    )
+    response = asyncio.run(
+        get_final_response(
+            _make_request(),
+            "TestBot",
+            session=session,
+            on_error=lambda e, msg: errors.append(str(e)),
+        )
+    )
+    assert response == "Hello"
+    assert errors == ["Invalid suggested_replies value in 'meta' event"]
+
+
+def test_meta_event_after_first_event_is_ignored() -> None:
+    async def collect(events: list[tuple[str, object]]) -> list[BotMessage]:
+        return [
+            message
+            async for message in stream_request_base(
+                _make_request(), "TestBot", session=_mock_session(events)
+            )
+        ]
+
+    first = asyncio.run(collect([("meta", {}), ("text", {"text": "Hi"}), ("done", {})]))
+    assert isinstance(first[0], MetaMessage)
+    late = asyncio.run(collect([("text", {"text": "Hi"}), ("meta", {}), ("done", {})]))
+    assert not any(isinstance(message, MetaMessage) for message in late)
+
+
+def test_get_final_response_with_fragmented_events() -> None:
+    # A large event split across many small network chunks, with multi-byte characters
+    # straddling chunk boundaries.
+    long_text = "héllo wörld " * 2000
+    session = _mock_session(
+        [("text", {"text": long_text}), ("text", {"text": "!"}), ("done", {})],
+        chunk_size=7,
+    )
+    response = asyncio.run(
+        get_final_response(_make_request(), "TestBot", session=session)
+    )
+    assert response == long_text + "!"
+
+
+def test_stream_request_coalesces_text_chunks() -> None:
+    async def collect() -> list[BotMessage]:
+        session = _mock_session(
+            [
+                ("text", {"text": "Hello"}),
+                ("text", {"text": " world"}),
+                ("suggested_reply", {"text": "What else?"}),
+                ("text", {"text": "!"}),
+                ("done", {}),
+            ]
+        )
+        return [
+            message
+            async for message in stream_request(
+                _make_request(), "TestBot", session=session, coalesce_window_ms=60_000
+            )
+        ]
+
+    messages = asyncio.run(collect())
+    assert [(message.text, message.is_suggested_reply) for message in messages] == [
+        ("Hello world", False),
+        ("What else?", True),
+        ("!", False),
+    ]
+
+
+def test_shared_session_does_not_store_cookies(monkeypatch: pytest.MonkeyPatch) -> None:
+    cookie_headers: list[Optional[str]] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        cookie_headers.append(request.headers.get("Cookie"))
+        return httpx.Response(
+            200,
+            headers={"Content-Type": "text/event-stream", "Set-Cookie": "session=a"},
+            content=_sse_body([("text", {"text": "Hi"}), ("done", {})]),
+        )
+
+    monkeypatch.setattr(
+        httpx,
+        "AsyncClient",
+        functools.partial(httpx.AsyncClient, transport=httpx.MockTransport(handler)),
+    )
+
+    async def run() -> None:
+        # Without a session, both queries go through the same shared client.
+        await get_final_response(_make_request(), "BotA", api_key="key_a")
+        await get_final_response(_make_request(), "BotB", api_key="key_b")
+
+    asyncio.run(run())
+    assert cookie_headers == [None, None]
+
+
+def test_stream_request_flushes_coalesced_text_when_window_expires() -> None:
+    async def stream() -> AsyncIterator[bytes]:
+        yield _sse_body([("text", {"text": "Hel"}), ("text", {"text": "lo"})])
+        await asyncio.sleep(0.5)
+        yield _sse_body([("text", {"text": " world"}), ("done", {})])
+
+    session = httpx.AsyncClient(
+        transport=httpx.MockTransport(
+            lambda request: httpx.Response(
+                200, headers={"Content-Type": "text/event-stream"}, content=stream()
+            )
+        )
+    )
+
+    async def collect() -> list[tuple[str, float]]:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        return [
+            (message.text, loop.time() - start)
+            async for message in stream_request(
+                _make_request(), "TestBot", session=session, coalesce_window_ms=50
+            )
+        ]
+
+    [(first, first_time), (second, second_time)] = asyncio.run(collect())
+    # Chunks that arrive together are merged, but buffered text is not held back until the
+    # next chunk arrives, and a late chunk does not join the earlier batch.
+    assert (first, second) == ("Hello", " world")
+    assert first_time < 0.4
+    assert second_time >= 0.5
+
+
+@pytest.mark.parametrize("use_http2", [False, True])
+def test_shared_session_uses_http2_only_when_enabled(
+    monkeypatch: pytest.MonkeyPatch, use_http2: bool
+) -> None:
+    http2_flags: list[object] = []
+    async_client = httpx.AsyncClient
+
+    def make_client(**kwargs: object) -> httpx.AsyncClient:
+        # Record the flag without needing the optional h2 package installed.
+        http2_flags.append(kwargs.pop("http2", False))
+        return async_client(**kwargs)  # pyright: ignore[reportArgumentType]
+
+    monkeypatch.setattr(httpx, "AsyncClient", make_client)
+    if use_http2:
+        monkeypatch.setattr(client, "USE_HTTP2", True)
+
+    async def run() -> None:
+        client._get_shared_session()
+
+    asyncio.run(run())
+    assert http2_flags == [use_http2]